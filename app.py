@@ -1,8 +1,12 @@
 # app.py
+import io
+
 import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
+import pyarrow as pa
+import pyarrow.csv as pacsv
 
 st.set_page_config(page_title="Qrauts AG GGV vs. Mieterstrom – Szenariorechner", layout="wide")
 
@@ -14,32 +18,92 @@ def annuity_factor(rate, n):
         return 1/n if n>0 else 0
     return (rate * (1 + rate)**n) / ((1 + rate)**n - 1)
 
-def cashflow_summary(df, discount_rate):
-    """Return NPV and simple payback from yearly cashflows DataFrame with column 'Netto Cashflow'."""
-    npv = 0.0
-    cum = 0.0
-    payback_year = None
-    for i, row in df.iterrows():
-        year = int(row["Jahr"])
-        cf = float(row["Netto Cashflow"])
-        npv += cf / ((1 + discount_rate) ** year)
-        cum += cf
-        if payback_year is None and cum >= 0:
-            payback_year = year
+def compound_series(factor, n):
+    """Return [1, factor, factor**2, ..., factor**n] as cumulative product."""
+    return np.concatenate([[1.0], np.cumprod(np.full(n, factor))])
+
+def cashflow_summary(years, net_cf, disc_factor):
+    """Return NPV and simple payback from yearly net cashflows and their discount factors 1/(1+r)**Jahr."""
+    npv = float((net_cf * disc_factor).sum())
+    cum = np.cumsum(net_cf)
+    hit = int(np.argmax(cum >= 0))
+    payback_year = int(years[hit]) if cum[hit] >= 0 else None
     return npv, payback_year
 
-def build_scenario(
-    label,
+def _scenario_core(
+    lifetime_years,
+    annual_production_kwh,
+    sc_share,
+    grid_share,
+    internal_price_eur,
+    mieterstrom_premium_eur,
+    export_price_eur,
+    opex_eur,
+    capex_eur,
+    deg,
+    infl,
+    price_growth,
+    disc,
+):
+    """Numeric core of build_scenarios: per-year arrays from unit-converted inputs.
+
+    internal_price_eur and mieterstrom_premium_eur are (scenarios,) arrays; revenue and cashflow
+    results are (scenarios, years), everything else (years,).
+    """
+    # Year 0 is investment; degradation and escalation apply from year 1 (commissioning).
+    years = np.arange(0, lifetime_years+1)
+    lag = np.maximum(0, years-1)
+
+    # degradation, price escalation and discounting as cumulative products
+    esc_deg = compound_series(1 - deg, lifetime_years)[lag]
+    esc_price = compound_series(1 + price_growth, lifetime_years)[lag]
+    esc_infl = compound_series(1 + infl, lifetime_years)[lag]
+    disc_factor = compound_series(1 / (1 + disc), lifetime_years)
+
+    prod = np.where(years == 0, 0.0, annual_production_kwh * esc_deg)
+
+    sc_kwh = prod * sc_share
+    grid_kwh = prod * grid_share
+
+    # Revenues: shared export, per-scenario internal sales and premium
+    export_rev = grid_kwh * export_price_eur * esc_price
+    internal_rev = internal_price_eur[:, None] * (sc_kwh * esc_price)[None, :]
+    premium_rev = mieterstrom_premium_eur[:, None] * (sc_kwh * esc_infl)[None, :]
+    total_rev = internal_rev + premium_rev + export_rev[None, :]
+
+    # Costs
+    opex_y = opex_eur * esc_infl
+    capex_y = np.where(years == 0, capex_eur, 0.0)
+
+    net_cf = total_rev - (opex_y + capex_y)[None, :]
+
+    return {
+        "years": years,
+        "prod": prod,
+        "sc_kwh": sc_kwh,
+        "grid_kwh": grid_kwh,
+        "internal_rev": internal_rev,
+        "export_rev": export_rev,
+        "premium_rev": premium_rev,
+        "opex_y": opex_y,
+        "capex_y": capex_y,
+        "total_rev": total_rev,
+        "net_cf": net_cf,
+        "disc_factor": disc_factor,
+    }
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def build_scenarios(
+    labels,
     kWp,
     specific_yield_kwh_per_kwp,
     self_consumption_share,
     grid_share_override,
-    grid_price_ct_per_kwh,
     eeg_feed_in_ct_per_kwh,
     direct_marketing_fee_ct_per_kwh,
-    internal_price_ct_per_kwh,
+    internal_prices_ct_per_kwh,
     mieterstrom_price_cap_ct_per_kwh,
-    mieterstrom_premium_ct_per_kwh,
+    mieterstrom_premiums_ct_per_kwh,
     capex_eur,
     opex_pct_of_capex,
     opex_fixed_eur,
@@ -51,6 +115,14 @@ def build_scenario(
     is_mieterstrom,
     battery_note
 ):
+    """Build all scenarios in one pass.
+
+    labels, internal_prices_ct_per_kwh, mieterstrom_premiums_ct_per_kwh and is_mieterstrom are
+    per-scenario tuples; energy, costs and escalation are shared, so price-dependent values are
+    computed as (scenarios, years) arrays against a single (years,) production vector.
+    Returns the yearly DataFrame and a dict of the arrays needed by cashflow_summary
+    ("years", "net_cf" per scenario, "disc_factor").
+    """
     # Energy
     annual_production_kwh = kWp * specific_yield_kwh_per_kwp
     deg = degradation_pct_per_year / 100.0
@@ -66,73 +138,59 @@ def build_scenario(
     else:
         grid_share = 1 - sc_share
 
-    # Prices (convert ct/kWh to €/kWh)
+    # Prices (convert ct/kWh to €/kWh), one entry per scenario
+    is_ms = np.asarray(is_mieterstrom, dtype=bool)
     eeg_price_eur = eeg_feed_in_ct_per_kwh / 100.0
     dm_fee_eur = direct_marketing_fee_ct_per_kwh / 100.0
-    internal_price_eur = internal_price_ct_per_kwh / 100.0
+    internal_price_eur = np.asarray(internal_prices_ct_per_kwh, dtype=float) / 100.0
     mieterstrom_cap_eur = mieterstrom_price_cap_ct_per_kwh / 100.0
-    mieterstrom_premium_eur = mieterstrom_premium_ct_per_kwh / 100.0
-    grid_price_eur = grid_price_ct_per_kwh / 100.0
+    mieterstrom_premium_eur = np.where(is_ms, np.asarray(mieterstrom_premiums_ct_per_kwh, dtype=float) / 100.0, 0.0)
 
     # Apply cap for Mieterstrom internal price
-    if is_mieterstrom:
-        internal_price_eur = min(internal_price_eur, mieterstrom_cap_eur)
+    internal_price_eur = np.where(is_ms, np.minimum(internal_price_eur, mieterstrom_cap_eur), internal_price_eur)
 
     # Determine export remuneration
     # For <=100 kWp, EEG Vergütung; >100 kWp typical Direktvermarktung (EEG - Vermarktergebühr) – user models via input
     export_price_eur = max(eeg_price_eur - dm_fee_eur, 0.0)
 
-    rows = []
-    cum_prod = 0
-    for year in range(0, lifetime_years+1):
-        # Degradation applies after year 0 (commissioning). Year 0 is investment.
-        if year == 0:
-            prod = 0.0
-        else:
-            prod = annual_production_kwh * ((1 - deg) ** (year-1))
-
-        sc_kwh = prod * sc_share
-        grid_kwh = prod * grid_share
-
-        # price escalation
-        internal_price_y = internal_price_eur * ((1 + price_growth) ** max(0, year-1))
-        grid_price_y = grid_price_eur * ((1 + price_growth) ** max(0, year-1))
-        export_price_y = export_price_eur * ((1 + price_growth) ** max(0, year-1))
-        premium_y = mieterstrom_premium_eur * ((1 + infl) ** max(0, year-1))
-
-        # Revenues
-        internal_rev = sc_kwh * internal_price_y
-        export_rev = grid_kwh * export_price_y
-        premium_rev = (sc_kwh * premium_y) if is_mieterstrom else 0.0
-        total_rev = internal_rev + export_rev + premium_rev
-
-        # Costs
-        opex = (capex_eur * (opex_pct_of_capex/100.0)) + opex_fixed_eur
-        opex_y = opex * ((1 + infl) ** max(0, year-1))
-
-        capex_y = capex_eur if year == 0 else 0.0
-
-        net_cf = total_rev - opex_y - capex_y
-
-        rows.append({
-            "Szenario": label,
-            "Jahr": year,
-            "Produktion [kWh]": prod,
-            "EV [kWh]": sc_kwh,
-            "Einspeisung [kWh]": grid_kwh,
-            "Erlös intern [€]": internal_rev,
-            "Einspeiseerlös [€]": export_rev,
-            "Mieterstromzuschlag [€]": premium_rev,
-            "OPEX [€]": opex_y,
-            "CAPEX [€]": capex_y,
-            "Umsatz gesamt [€]": total_rev,
-            "Netto Cashflow": net_cf,
-            "Annahme Batterie": battery_note,
-        })
-
-    df = pd.DataFrame(rows)
-    npv, payback = cashflow_summary(df, disc)
-    return df, npv, payback
+    # Costs
+    opex_eur = (capex_eur * (opex_pct_of_capex/100.0)) + opex_fixed_eur
+
+    r = _scenario_core(
+        lifetime_years=lifetime_years,
+        annual_production_kwh=annual_production_kwh,
+        sc_share=sc_share,
+        grid_share=grid_share,
+        internal_price_eur=internal_price_eur,
+        mieterstrom_premium_eur=mieterstrom_premium_eur,
+        export_price_eur=export_price_eur,
+        opex_eur=opex_eur,
+        capex_eur=capex_eur,
+        deg=deg,
+        infl=infl,
+        price_growth=price_growth,
+        disc=disc,
+    )
+
+    # Long format: scenarios stacked row-wise, (scenarios, years) arrays flattened in C order
+    n_scen, n_years = r["net_cf"].shape
+    df = pd.DataFrame({
+        "Szenario": np.repeat(np.asarray(labels), n_years),
+        "Jahr": np.tile(r["years"], n_scen),
+        "Produktion [kWh]": np.tile(r["prod"], n_scen),
+        "EV [kWh]": np.tile(r["sc_kwh"], n_scen),
+        "Einspeisung [kWh]": np.tile(r["grid_kwh"], n_scen),
+        "Erlös intern [€]": r["internal_rev"].reshape(-1),
+        "Einspeiseerlös [€]": np.tile(r["export_rev"], n_scen),
+        "Mieterstromzuschlag [€]": r["premium_rev"].reshape(-1),
+        "OPEX [€]": np.tile(r["opex_y"], n_scen),
+        "CAPEX [€]": np.tile(r["capex_y"], n_scen),
+        "Umsatz gesamt [€]": r["total_rev"].reshape(-1),
+        "Netto Cashflow": r["net_cf"].reshape(-1),
+        "Annahme Batterie": battery_note,
+    })
+    arrays = {"years": r["years"], "net_cf": r["net_cf"], "disc_factor": r["disc_factor"]}
+    return df, arrays
 
 # -----------------------------
 # Sidebar Inputs
@@ -179,18 +237,17 @@ mieterstrom_cap = 0.9 * grundversorgung_ct
 # -----------------------------
 # Build Scenarios
 # -----------------------------
-df_ggv, npv_ggv, pb_ggv = build_scenario(
-    label="GGV",
+scenario_inputs = dict(
+    labels=("GGV", "Mieterstrom"),
     kWp=kWp,
     specific_yield_kwh_per_kwp=specific_yield,
     self_consumption_share=sc_share,
     grid_share_override=(grid_share_override if use_override else None),
-    grid_price_ct_per_kwh=grundversorgung_ct,
     eeg_feed_in_ct_per_kwh=eeg_feed_ct,
     direct_marketing_fee_ct_per_kwh=dm_fee_ct,
-    internal_price_ct_per_kwh=ggv_price_ct,
+    internal_prices_ct_per_kwh=(ggv_price_ct, mieterstrom_price_ct),
     mieterstrom_price_cap_ct_per_kwh=mieterstrom_cap,
-    mieterstrom_premium_ct_per_kwh=0.0,
+    mieterstrom_premiums_ct_per_kwh=(0.0, mieterstrom_premium_ct),
     capex_eur=capex,
     opex_pct_of_capex=opex_pct,
     opex_fixed_eur=opex_fixed,
@@ -199,35 +256,23 @@ df_ggv, npv_ggv, pb_ggv = build_scenario(
     inflation_pct=inflation,
     energy_price_growth_pct=price_growth,
     discount_rate_pct=discount,
-    is_mieterstrom=False,
-    battery_note=battery_note
+    is_mieterstrom=(False, True),
+    battery_note=battery_note,
 )
 
-df_ms, npv_ms, pb_ms = build_scenario(
-    label="Mieterstrom",
-    kWp=kWp,
-    specific_yield_kwh_per_kwp=specific_yield,
-    self_consumption_share=sc_share,
-    grid_share_override=(grid_share_override if use_override else None),
-    grid_price_ct_per_kwh=grundversorgung_ct,
-    eeg_feed_in_ct_per_kwh=eeg_feed_ct,
-    direct_marketing_fee_ct_per_kwh=dm_fee_ct,
-    internal_price_ct_per_kwh=mieterstrom_price_ct,
-    mieterstrom_price_cap_ct_per_kwh=mieterstrom_cap,
-    mieterstrom_premium_ct_per_kwh=mieterstrom_premium_ct,
-    capex_eur=capex,
-    opex_pct_of_capex=opex_pct,
-    opex_fixed_eur=opex_fixed,
-    lifetime_years=lifetime,
-    degradation_pct_per_year=degradation,
-    inflation_pct=inflation,
-    energy_price_growth_pct=price_growth,
-    discount_rate_pct=discount,
-    is_mieterstrom=True,
-    battery_note=battery_note
-)
+# Skip the rebuild entirely when a rerun leaves every model input unchanged: a widget whose value
+# is currently ignored (Δ-EV slider with the battery option off, override slider with the override
+# unchecked), a widget set back to the same value, or the download button click.
+# st.cache_data on build_scenarios still covers returning to earlier input combinations.
+scenario_key = tuple(scenario_inputs.items())
+if st.session_state.get("scenario_key") == scenario_key and "scenario_results" in st.session_state:
+    df_all, arrays = st.session_state["scenario_results"]
+else:
+    df_all, arrays = build_scenarios(**scenario_inputs)
+    st.session_state["scenario_key"] = scenario_key
+    st.session_state["scenario_results"] = (df_all, arrays)
 
-df_all = pd.concat([df_ggv, df_ms], ignore_index=True)
+(npv_ggv, pb_ggv), (npv_ms, pb_ms) = [cashflow_summary(arrays["years"], cf, arrays["disc_factor"]) for cf in arrays["net_cf"]]
 
 # -----------------------------
 # UI – Headline & KPIs
@@ -247,45 +292,73 @@ st.caption("Hinweis: Dies ist ein vereinfachtes Modell (keine Rechts-/Steuerbera
 # -----------------------------
 # Charts
 # -----------------------------
+# Figures are cached per result set; st.cache_data hands every caller its own copy and
+# max_entries bounds how many input combinations stay in memory.
+@st.cache_data(show_spinner=False, max_entries=32)
+def cashflow_figure(df_all):
+    """Yearly and cumulative net cashflow as two facet rows of one figure."""
+    # Chart values are rounded to whole euros, after the cumulative sum.
+    df_plot = df_all.loc[df_all["Jahr"]>0, ["Szenario", "Jahr", "Netto Cashflow"]]
+    df_plot = df_plot.assign(**{"Kumulierter Cashflow": df_plot.groupby("Szenario", sort=False)["Netto Cashflow"].cumsum()})
+    df_long = df_plot.melt(id_vars=["Szenario","Jahr"], value_vars=["Netto Cashflow","Kumulierter Cashflow"], var_name="Kennzahl", value_name="Cashflow [€]")
+    df_long["Cashflow [€]"] = df_long["Cashflow [€]"].round().astype("int64")
+
+    fig = px.line(df_long, x="Jahr", y="Cashflow [€]", color="Szenario", facet_row="Kennzahl", height=700, title="Jährlicher und kumulierter Netto-Cashflow")
+    fig.update_yaxes(matches=None)
+    fig.for_each_annotation(lambda a: a.update(text=a.text.split("=", 1)[-1]))
+    return fig
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def tidy_energy(df_all):
+    """EV and feed-in per scenario and year in long format, rounded to whole kWh for the chart."""
+    df_energy = df_all[df_all["Jahr"]>0].melt(id_vars=["Szenario","Jahr"], value_vars=["EV [kWh]","Einspeisung [kWh]"], var_name="Art", value_name="kWh")
+    df_energy["kWh"] = df_energy["kWh"].round().astype("int64")
+    return df_energy
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def energy_figure(df_energy):
+    return px.area(df_energy, x="Jahr", y="kWh", color="Art", facet_col="Szenario", facet_col_wrap=2, title="Energieflüsse EV vs. Einspeisung")
+
+TABLE_NUMBER_COLUMNS = [
+    "Produktion [kWh]",
+    "EV [kWh]",
+    "Einspeisung [kWh]",
+    "Erlös intern [€]",
+    "Einspeiseerlös [€]",
+    "Mieterstromzuschlag [€]",
+    "OPEX [€]",
+    "CAPEX [€]",
+    "Umsatz gesamt [€]",
+    "Netto Cashflow",
+]
+
+# step=1 makes st.dataframe show whole numbers with thousands separators; the columns stay
+# numeric, so sorting is numeric and values are right-aligned.
+TABLE_COLUMN_CONFIG = {c: st.column_config.NumberColumn(step=1) for c in TABLE_NUMBER_COLUMNS}
+
 tab1, tab2, tab3 = st.tabs(["Cashflows", "Energieflüsse", "Jahreswerte"])
 
 with tab1:
-    df_plot = df_all[df_all["Jahr"]>0].copy()
-    fig_cf = px.line(df_plot, x="Jahr", y="Netto Cashflow", color="Szenario", title="Jährlicher Netto-Cashflow")
-    st.plotly_chart(fig_cf, use_container_width=True)
-
-    df_cum = df_plot.groupby(["Szenario"])["Netto Cashflow"].cumsum().reset_index()
-    df_cum["Jahr"] = df_plot["Jahr"].values
-    df_cum["Szenario"] = df_plot["Szenario"].values
-    fig_cum = px.line(df_cum, x="Jahr", y="Netto Cashflow", color="Szenario", title="Kumulierter Cashflow")
-    st.plotly_chart(fig_cum, use_container_width=True)
+    st.plotly_chart(cashflow_figure(df_all), use_container_width=True)
 
 with tab2:
-    df_energy = df_all[df_all["Jahr"]>0].copy()
-    df_energy = df_energy.melt(id_vars=["Szenario","Jahr"], value_vars=["EV [kWh]","Einspeisung [kWh]"], var_name="Art", value_name="kWh")
-    fig_e = px.area(df_energy, x="Jahr", y="kWh", color="Art", facet_col="Szenario", facet_col_wrap=2, title="Energieflüsse EV vs. Einspeisung")
-    st.plotly_chart(fig_e, use_container_width=True)
+    st.plotly_chart(energy_figure(tidy_energy(df_all)), use_container_width=True)
 
 with tab3:
-    st.dataframe(df_all.style.format({
-        "Produktion [kWh]":"{:,.0f}",
-        "EV [kWh]":"{:,.0f}",
-        "Einspeisung [kWh]":"{:,.0f}",
-        "Erlös intern [€]":"{:,.0f}",
-        "Einspeiseerlös [€]":"{:,.0f}",
-        "Mieterstromzuschlag [€]":"{:,.0f}",
-        "OPEX [€]":"{:,.0f}",
-        "CAPEX [€]":"{:,.0f}",
-        "Umsatz gesamt [€]":"{:,.0f}",
-        "Netto Cashflow":"{:,.0f}",
-    }), use_container_width=True)
+    st.dataframe(df_all, column_config=TABLE_COLUMN_CONFIG, use_container_width=True)
 
 # -----------------------------
 # Downloads
 # -----------------------------
+@st.cache_data(show_spinner=False, max_entries=32)
+def to_csv_bytes(df):
+    buf = io.BytesIO()
+    pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buf)
+    return buf.getvalue()
+
 st.download_button(
     "📤 Export: Jahreswerte (CSV)",
-    data=df_all.to_csv(index=False).encode("utf-8"),
+    data=to_csv_bytes(df_all),
     file_name="szenario_jahreswerte.csv",
     mime="text/csv"
 )